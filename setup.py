@@ -1,3 +1,5 @@
+import os
+
 from setuptools import Extension, setup
 
 try:
@@ -7,13 +9,38 @@ except ImportError:
 
 ext = '.pyx' if cythonize else '.c'
 
+# Optional, for GCC / clang only - by default, we build portable binaries with the usual compiler flags.
+compile_args, link_args = [], []
+if os.environ.get("BORGHASH_NATIVE") == "1":
+    # optimize for the CPU of this machine (e.g. to use AVX2), the binaries might not work on other machines.
+    compile_args += ["-O3", "-march=native", "-flto", "-fno-plt"]
+    link_args += ["-O3", "-flto"]
+pgo = os.environ.get("BORGHASH_PGO")  # profile-guided optimization: "generate", then "use"
+pgo_dir = os.path.abspath(os.environ.get("BORGHASH_PGO_DIR", "build/pgo"))
+if pgo == "generate":
+    compile_args += [f"-fprofile-generate={pgo_dir}"]
+    link_args += [f"-fprofile-generate={pgo_dir}"]
+elif pgo == "use":
+    compile_args += [f"-fprofile-use={pgo_dir}", "-fprofile-correction"]
+    link_args += [f"-fprofile-use={pgo_dir}"]
+elif pgo:
+    raise ValueError("BORGHASH_PGO must be 'generate' or 'use'.")
+
 extensions = [
-    Extension("borghash.HashTable", ["src/borghash/HashTable" + ext]),
-    Extension("borghash.HashTableNT", ["src/borghash/HashTableNT" + ext]),
+    Extension("borghash.HashTable", ["src/borghash/HashTable" + ext],
+              extra_compile_args=compile_args, extra_link_args=link_args),
+    Extension("borghash.HashTableNT", ["src/borghash/HashTableNT" + ext],
+              extra_compile_args=compile_args, extra_link_args=link_args),
 ]
 
 if cythonize:
-    extensions = cythonize(extensions, language_level="3str")
+    compiler_directives = dict(
+        # the hot code works with raw pointers and checks sizes itself.
+        boundscheck=False,
+        wraparound=False,
+        initializedcheck=False,
+    )
+    extensions = cythonize(extensions, language_level="3str", compiler_directives=compiler_directives)
 
 setup(
     package_data={"borghash": ["*.pxd", "*.pyx"]},
@@ -1,19 +1,54 @@
+cimport cython
 from libc.stdint cimport uint8_t, uint32_t
+from cpython.pythread cimport PyThread_type_lock
 
 cdef class HashTable:
     cdef int ksize, vsize
+    cdef int tag_offset  # the tag of a key is key[tag_offset], see _get_tag
     cdef readonly size_t capacity, used
-    cdef size_t initial_capacity, tombstones
+    cdef size_t initial_capacity, tombstones, mask
     cdef float max_load_factor, min_load_factor, shrink_factor, grow_factor
     cdef uint32_t* table
+    cdef uint8_t* tags
     cdef uint32_t kv_capacity, kv_used
     cdef float kv_grow_factor
     cdef uint8_t* keys
     cdef uint8_t* values
-    cdef int stats_get, stats_set, stats_del, stats_iter, stats_lookup, stats_linear
+    cdef uint8_t* keys_mem  # the memory blocks containing keys / values (which are aligned to a cache line)
+    cdef uint8_t* values_mem
+    cdef int stats_get, stats_set, stats_del, stats_iter, stats_lookup, stats_linear, stats_compare
     cdef int stats_resize_table, stats_resize_kv
+    cdef PyThread_type_lock lock  # held while busy (running a bulk operation without the GIL)
+    cdef PyThread_type_lock gate  # held while there are waiters (threads waiting for a bulk operation to finish)
+    cdef bint busy
+    cdef int waiters
 
-    cdef size_t _get_index(self, uint8_t* key)
-    cdef int _lookup_index(self, uint8_t* key_ptr, size_t* index_ptr)
-    cdef void _resize_table(self, size_t new_capacity)
-    cdef void _resize_kv(self, size_t new_capacity)
+    # final: no overriding in subclasses, so these are called directly (not via the vtable) and can be inlined.
+    @cython.final
+    cdef inline size_t _get_index(self, uint8_t* key) noexcept nogil
+    @cython.final
+    cdef inline uint8_t _get_tag(self, uint8_t* key) noexcept nogil
+    @cython.final
+    cdef inline void _set_tag(self, size_t index, uint8_t tag) noexcept nogil
+    @cython.final
+    cdef inline void _prefetch(self, uint8_t* key_ptr) noexcept nogil
+    @cython.final
+    cdef int _lookup_index(self, uint8_t* key_ptr, size_t* index_ptr) noexcept nogil
+    @cython.final
+    cdef int _insert_raw(self, uint8_t* key_ptr, uint8_t* value_ptr) except -1 nogil
+    @cython.final
+    cdef int _insert_new(self, size_t index, uint8_t* key_ptr, uint8_t* value_ptr) except -1 nogil
+    @cython.final
+    cdef uint8_t* _lookup_value(self, uint8_t* key_ptr) noexcept nogil
+    @cython.final
+    cdef size_t _find_free_index(self, uint8_t* key_ptr) noexcept nogil
+    @cython.final
+    cdef int _resize_table(self, size_t new_capacity) except -1 nogil
+    @cython.final
+    cdef int _resize_kv(self, size_t new_capacity) except -1 nogil
+    @cython.final
+    cdef inline void _wait(self) noexcept
+    @cython.final
+    cdef inline void _begin_nogil_op(self) noexcept
+    @cython.final
+    cdef inline void _end_nogil_op(self) noexcept
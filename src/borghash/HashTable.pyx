@@ -2,29 +2,196 @@
 HashTable: low-level hash table mapping fully random bytes keys to bytes values.
            Key and value lengths can be chosen, but are fixed thereafter.
            The keys and values are stored in arrays separate from the hashtable.
-           The hashtable only stores the 32-bit indices into the key/value arrays.
+           The hashtable only stores the 32-bit indices into the key/value arrays
+           (and a 1-byte tag per bucket to speed up lookups).
 """
 from __future__ import annotations
 from typing import BinaryIO, Iterator, Any
 
 from libc.stdlib cimport malloc, free, realloc
-from libc.string cimport memcpy, memset, memcmp
-from libc.stdint cimport uint8_t, uint32_t
-
-from collections.abc import Mapping
+from libc.string cimport memcpy, memmove, memset
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, SIZE_MAX
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+from cpython.pythread cimport PyThread_allocate_lock, PyThread_free_lock, PyThread_acquire_lock, \
+    PyThread_release_lock, WAIT_LOCK
+
+from collections.abc import Mapping, Sized
+
+cdef extern from * nogil:
+    """
+    /* Group probing: compare 16 tags at once, return a bitmask of the matching slots.
+     * Slot i of the group corresponds to bit (i << BH_GROUP_SHIFT) of the mask. */
+    #if defined(__SSE2__) || defined(_M_X64) || (defined(_M_IX86_FP) && _M_IX86_FP >= 2)
+    #include <emmintrin.h>
+    #define BH_GROUP_SHIFT 0
+    static inline uint64_t bh_group_match(const uint8_t *group, uint8_t tag) {
+        __m128i tags = _mm_loadu_si128((const __m128i *) group);
+        return (uint64_t) _mm_movemask_epi8(_mm_cmpeq_epi8(tags, _mm_set1_epi8((char) tag)));
+    }
+    #elif defined(__ARM_NEON) || defined(__aarch64__)
+    #include <arm_neon.h>
+    #define BH_GROUP_SHIFT 2
+    static inline uint64_t bh_group_match(const uint8_t *group, uint8_t tag) {
+        /* there is no movemask on NEON, narrow the 16x8bit result to 16x4bit instead. */
+        uint8x16_t eq = vceqq_u8(vld1q_u8(group), vdupq_n_u8(tag));
+        uint8x8_t nibbles = vshrn_n_u16(vreinterpretq_u16_u8(eq), 4);
+        return vget_lane_u64(vreinterpret_u64_u8(nibbles), 0) & 0x8888888888888888ULL;
+    }
+    #elif defined(__BYTE_ORDER__)
+    /* no SIMD, but we can still process 8 tags at once in a 64-bit word (SWAR). */
+    #define BH_GROUP_SHIFT 0
+    static inline uint64_t bh_match8(uint64_t word, uint8_t tag) {
+        /* set the high bit of each byte equal to tag (exact, no false positives due to carries) */
+        const uint64_t low7 = 0x7F7F7F7F7F7F7F7FULL;
+        uint64_t x = word ^ (0x0101010101010101ULL * tag);
+        uint64_t y = ~(((x & low7) + low7) | x | low7);
+        /* gather the 8 high bits into the lowest byte (each lands on a distinct bit, no carries) */
+        return ((y >> 7) * 0x0102040810204080ULL) >> 56;
+    }
+    static inline uint64_t bh_group_match(const uint8_t *group, uint8_t tag) {
+        uint64_t lo, hi;
+        memcpy(&lo, group, 8);
+        memcpy(&hi, group + 8, 8);
+    #if __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+        lo = __builtin_bswap64(lo);
+        hi = __builtin_bswap64(hi);
+    #endif
+        return bh_match8(lo, tag) | bh_match8(hi, tag) << 8;
+    }
+    #else
+    #define BH_GROUP_SHIFT 0
+    static inline uint64_t bh_group_match(const uint8_t *group, uint8_t tag) {
+        uint64_t mask = 0;
+        for (int i = 0; i < 16; i++)
+            mask |= (uint64_t) (group[i] == tag) << i;
+        return mask;
+    }
+    #endif
+
+    /* Key comparison: 256-bit keys are the common case, compare them inline instead of calling memcmp. */
+    #if defined(__AVX2__)
+    #include <immintrin.h>
+    #endif
+    static inline int bh_keys_equal(const uint8_t *a, const uint8_t *b, size_t size) {
+        if (size == 32) {
+    #if defined(__AVX2__)
+            __m256i va = _mm256_loadu_si256((const __m256i *) a);
+            __m256i vb = _mm256_loadu_si256((const __m256i *) b);
+            return _mm256_movemask_epi8(_mm256_cmpeq_epi8(va, vb)) == -1;
+    #else
+            uint64_t a0, a1, a2, a3, b0, b1, b2, b3;
+            memcpy(&a0, a, 8); memcpy(&a1, a + 8, 8); memcpy(&a2, a + 16, 8); memcpy(&a3, a + 24, 8);
+            memcpy(&b0, b, 8); memcpy(&b1, b + 8, 8); memcpy(&b2, b + 16, 8); memcpy(&b3, b + 24, 8);
+            return ((a0 ^ b0) | (a1 ^ b1) | (a2 ^ b2) | (a3 ^ b3)) == 0;
+    #endif
+        }
+        return memcmp(a, b, size) == 0;
+    }
+
+    /* Copy a key / value: for the usual small sizes, memcpy with a constant size compiles to a few
+     * loads / stores instead of a library call. */
+    static inline void bh_copy(uint8_t *dst, const uint8_t *src, size_t size) {
+        switch (size) {
+            case 4: memcpy(dst, src, 4); break;
+            case 8: memcpy(dst, src, 8); break;
+            case 32: memcpy(dst, src, 32); break;
+            default: memcpy(dst, src, size);
+        }
+    }
+
+    #if defined(__GNUC__) || defined(__clang__)
+    #define bh_ctz64(x) __builtin_ctzll(x)
+    #define bh_clz64(x) __builtin_clzll(x)
+    #define bh_prefetch(p) __builtin_prefetch(p)
+    #else
+    #define bh_prefetch(p) ((void) 0)
+    static inline int bh_ctz64(uint64_t x) {
+        int n = 0;
+        while (!(x & 1)) { x >>= 1; n++; }
+        return n;
+    }
+    static inline int bh_clz64(uint64_t x) {
+        int n = 0;
+        while (!(x & 0x8000000000000000ULL)) { x <<= 1; n++; }
+        return n;
+    }
+    #endif
+
+    /* number of slots before the first / after the last matching slot of a group, mask must not be 0. */
+    static inline size_t bh_group_head(uint64_t mask) {
+        return bh_ctz64(mask) >> BH_GROUP_SHIFT;
+    }
+    static inline size_t bh_group_tail(uint64_t mask) {
+        return (bh_clz64(mask) >> BH_GROUP_SHIFT) - (64 >> BH_GROUP_SHIFT) + 16;
+    }
+    """
+    int BH_GROUP_SHIFT
+    uint64_t bh_group_match(const uint8_t* group, uint8_t tag)
+    bint bh_keys_equal(const uint8_t* a, const uint8_t* b, size_t size)
+    void bh_copy(uint8_t* dst, const uint8_t* src, size_t size)
+    int bh_ctz64(uint64_t x)
+    size_t bh_group_head(uint64_t mask)
+    size_t bh_group_tail(uint64_t mask)
+    void bh_prefetch(const void* p)
 
 MAGIC = b"BORGHASH"
 assert len(MAGIC) == 8
 VERSION = 1  # version of the on-disk (serialized) format produced by .write().
 HEADER_FMT = "<8sII"  # magic, version, meta length
 
-MIN_CAPACITY = 1000  # never shrink the hash table below this capacity
+MIN_CAPACITY = 1000  # never shrink the hash table below this capacity (rounded up to a power of 2)
 
 cdef uint32_t FREE_BUCKET = 0xFFFFFFFF
 cdef uint32_t TOMBSTONE_BUCKET = 0xFFFFFFFE
 # ...
 cdef uint32_t RESERVED = 0xFFFFFF00  # all >= this is reserved
 
+# Every bucket in .table has a 1-byte tag in .tags, so we can check 16 buckets at once (group probing).
+# If a group has no free bucket, probing continues with the adjacent group (linear probing, as this keeps
+# the memory accesses sequential; with random keys, more than 1 group is rarely needed anyway).
+# Used buckets have a tag taken from the key (but never FREE_TAG / TOMBSTONE_TAG), see _get_tag.
+cdef uint8_t FREE_TAG = 0x00
+cdef uint8_t TOMBSTONE_TAG = 0x01
+cdef size_t GROUP_SIZE = 16  # the hash table capacity must be >= GROUP_SIZE
+
+
+cdef size_t CACHE_LINE = 64
+cdef size_t PREFETCH_DISTANCE = 8  # bulk operations prefetch for the key this many keys ahead
+
+
+cdef inline size_t _align_offset(uint8_t* mem) noexcept nogil:
+    """return the offset of the first cache line aligned address in mem"""
+    return (CACHE_LINE - (<size_t> mem & (CACHE_LINE - 1))) & (CACHE_LINE - 1)
+
+
+cdef uint8_t* _realloc_aligned(uint8_t** mem_ptr, size_t used, size_t size) noexcept nogil:
+    """
+    realloc the memory block *mem_ptr to hold size bytes of data aligned to a cache line (so e.g. a
+    32-byte key never straddles 2 cache lines), keeping the first used bytes of the data.
+    return the new data pointer (*mem_ptr is set to the new memory block).
+    if realloc fails, return NULL (*mem_ptr and the data stay unchanged).
+    """
+    cdef size_t offset = _align_offset(mem_ptr[0])
+    cdef uint8_t* mem = <uint8_t*> realloc(mem_ptr[0], size + CACHE_LINE - 1)
+    if mem == NULL:
+        return NULL
+    cdef size_t new_offset = _align_offset(mem)
+    if new_offset != offset:
+        memmove(mem + new_offset, mem + offset, used)
+    mem_ptr[0] = mem
+    return mem + new_offset
+
+
+cdef size_t _next_pow2(size_t n) noexcept nogil:
+    """return the smallest power of 2 >= n, 0 if it does not fit into a size_t"""
+    cdef size_t p = 1
+    while p < n:
+        if p > SIZE_MAX >> 1:
+            return 0
+        p <<= 1
+    return p
+
 _NoDefault = object()
 
 def _fill(this: Any, other: Any) -> None:
@@ -59,6 +226,15 @@ cdef class HashTable:
             raise ValueError("value_size must be specified and must be > 0.")
         self.ksize = key_size
         self.vsize = value_size
+        # the last key byte is not used by _get_index, except for 4-byte keys: take the first byte (only
+        # used by _get_index for capacities > 2**24), so keys with the same home bucket rarely share a tag.
+        self.tag_offset = key_size - 1 if key_size > 4 else 0
+        # vvv thread synchronization, see _wait vvv
+        self.lock = PyThread_allocate_lock()
+        self.gate = PyThread_allocate_lock()
+        self.busy = False
+        self.waiters = 0
+        # ^^^ thread synchronization ^^^
         # vvv hash table vvv
         self.max_load_factor = max_load_factor
         self.min_load_factor = min_load_factor
@@ -66,16 +242,18 @@ cdef class HashTable:
         self.grow_factor = grow_factor
         self.initial_capacity = capacity
         self.capacity = 0
+        self.mask = 0
         self.used = 0
         self.tombstones = 0
         self.table = NULL
+        self.tags = NULL
         self._resize_table(self.initial_capacity)
         # ^^^ hash table ^^^
         # vvv kv arrays vvv
         self.kv_grow_factor = kv_grow_factor
         self.kv_used = 0
-        self.keys = NULL
-        self.values = NULL
+        self.keys = self.keys_mem = NULL
+        self.values = self.values_mem = NULL
         self._resize_kv(int(self.initial_capacity * self.max_load_factor))
         # ^^^ kv arrays ^^^
         # vvv stats vvv
@@ -84,19 +262,45 @@ cdef class HashTable:
         self.stats_del = 0
         self.stats_iter = 0  # .items() calls
         self.stats_lookup = 0  # _lookup_index calls
-        self.stats_linear = 0  # how many steps the linear search inside _lookup_index needed
+        self.stats_linear = 0  # how many groups the linear search inside _lookup_index needed to look at
+        self.stats_compare = 0  # how many full key comparisons were needed (only done if the tag matches)
         self.stats_resize_table = 0
         self.stats_resize_kv = 0
         # ^^^ stats ^^^
+        if isinstance(items, Sized):
+            self.reserve(len(items))
         _fill(self, items)
 
+    def reserve(self, n: int) -> None:
+        """
+        Make room for n kv pairs (in total), so inserting up to that many needs no further resizing.
+
+        Use this if the (maximum) count of kv pairs is known in advance.
+        """
+        if n < 0:
+            raise ValueError("n must be >= 0")
+        self._wait()
+        cdef size_t capacity = <size_t> (n / self.max_load_factor) + 1
+        if capacity > self.capacity:
+            self._resize_table(capacity)
+        # deleted kv pairs still occupy their place in the kv arrays, new kv pairs are appended.
+        cdef size_t kv_capacity = self.kv_used - self.used + n
+        if kv_capacity > self.kv_capacity:
+            self._resize_kv(kv_capacity)
+
     def __del__(self) -> None:
         free(self.table)
-        free(self.keys)
-        free(self.values)
+        free(self.tags)
+        free(self.keys_mem)
+        free(self.values_mem)
+        if self.lock:
+            PyThread_free_lock(self.lock)
+        if self.gate:
+            PyThread_free_lock(self.gate)
 
     def clear(self) -> None:
         """Empty the HashTable and start from scratch."""
+        self._wait()
         self.capacity = 0
         self.used = 0
         self._resize_table(self.initial_capacity)
@@ -104,98 +308,229 @@ cdef class HashTable:
         self._resize_kv(int(self.initial_capacity * self.max_load_factor))
 
     def __len__(self) -> int:
+        self._wait()
         return self.used
 
-    cdef size_t _get_index(self, uint8_t* key):
+    cdef inline void _wait(self) noexcept:
+        """
+        Wait until a bulk operation running in another thread (without holding the GIL) has finished.
+
+        All methods accessing the hash table or kv arrays while holding the GIL must call this first,
+        without running Python code in between (that could let another thread start a bulk operation).
+        """
+        while self.busy:
+            self.waiters += 1
+            if self.waiters == 1:
+                PyThread_acquire_lock(self.gate, WAIT_LOCK)  # close the gate, see _begin_nogil_op
+            with nogil:
+                PyThread_acquire_lock(self.lock, WAIT_LOCK)
+                PyThread_release_lock(self.lock)
+            self.waiters -= 1
+            if self.waiters == 0:
+                PyThread_release_lock(self.gate)
+
+    cdef inline void _begin_nogil_op(self) noexcept:
+        """
+        Start a bulk operation that runs without holding the GIL, so other threads can run meanwhile.
+
+        While it runs, the other methods wait for it in _wait. Call _end_nogil_op when done.
+        """
+        while True:
+            self._wait()
+            if not self.waiters:
+                break
+            # threads still waiting for the previous bulk operation go first, so that a loop of bulk
+            # operations can not starve them: wait (without the GIL) until the last of them opens the gate.
+            with nogil:
+                PyThread_acquire_lock(self.gate, WAIT_LOCK)
+                PyThread_release_lock(self.gate)
+        self.busy = True
+        PyThread_acquire_lock(self.lock, WAIT_LOCK)  # not held by others (except briefly in _wait)
+
+    cdef inline void _end_nogil_op(self) noexcept:
+        self.busy = False
+        PyThread_release_lock(self.lock)
+
+    cdef inline size_t _get_index(self, uint8_t* key) noexcept nogil:
         """Key must be perfectly random bytes, so we don't need a hash function here."""
         cdef uint32_t key32 = (key[0] << 24) | (key[1] << 16) | (key[2] << 8) | key[3]
-        return key32 % self.capacity
+        return key32 & self.mask
+
+    cdef inline uint8_t _get_tag(self, uint8_t* key) noexcept nogil:
+        """Key must be perfectly random bytes, the tag byte is independent of the bytes used by _get_index."""
+        cdef uint8_t tag = key[self.tag_offset]
+        return tag if tag > TOMBSTONE_TAG else tag + 2  # FREE_TAG / TOMBSTONE_TAG must not be used
+
+    cdef inline void _set_tag(self, size_t index, uint8_t tag) noexcept nogil:
+        self.tags[index] = tag
+        if index < GROUP_SIZE - 1:
+            # mirror the first tags behind the end, so a group starting near the end can be loaded at once.
+            self.tags[self.capacity + index] = tag
+
+    cdef inline void _prefetch(self, uint8_t* key_ptr) noexcept nogil:
+        """start loading the memory a lookup of key_ptr will need first (tags and table entries)."""
+        cdef size_t index = self._get_index(key_ptr)
+        bh_prefetch(self.tags + index)
+        bh_prefetch(self.table + index)
 
-    cdef int _lookup_index(self, uint8_t* key_ptr, size_t* index_ptr):
+    cdef int _lookup_index(self, uint8_t* key_ptr, size_t* index_ptr) noexcept nogil:
         """
         search for a specific key.
         if found, return 1 and set *index_ptr to the index of the bucket in self.table.
         if not found, return 0 and set *index_ptr to the index of a free bucket in self.table.
         """
         cdef size_t index = self._get_index(key_ptr)
+        cdef uint8_t tag = self._get_tag(key_ptr)
+        cdef size_t i
         cdef uint32_t kv_index
+        cdef uint64_t match, free_mask
         self.stats_lookup += 1
-        while (kv_index := self.table[index]) != FREE_BUCKET:
+        bh_prefetch(self.table + index)  # likely needed soon, load it in parallel to the tags
+        while True:
             self.stats_linear += 1
-            if kv_index != TOMBSTONE_BUCKET and memcmp(self.keys + kv_index * self.ksize, key_ptr, self.ksize) == 0:
+            match = bh_group_match(self.tags + index, tag)
+            free_mask = bh_group_match(self.tags + index, FREE_TAG)
+            if not free_mask:
+                # the next group will be needed (unless the key is found in this one), start loading it.
+                bh_prefetch(self.tags + ((index + GROUP_SIZE) & self.mask))
+                bh_prefetch(self.table + ((index + GROUP_SIZE) & self.mask))
+            # note: the key may be located behind a free bucket of the group, see __delitem__.
+            while match:
+                i = (index + (bh_ctz64(match) >> BH_GROUP_SHIFT)) & self.mask
+                kv_index = self.table[i]
+                self.stats_compare += 1
+                if bh_keys_equal(self.keys + kv_index * self.ksize, key_ptr, self.ksize):
+                    if index_ptr:
+                        index_ptr[0] = i
+                    return 1  # found
+                match &= match - 1
+            if free_mask:
                 if index_ptr:
-                    index_ptr[0] = index
-                return 1  # found
-            index = (index + 1) % self.capacity
-        if index_ptr:
-            index_ptr[0] = index
-        return 0  # not found
+                    index_ptr[0] = (index + (bh_ctz64(free_mask) >> BH_GROUP_SHIFT)) & self.mask
+                return 0  # not found
+            index = (index + GROUP_SIZE) & self.mask
 
-    def __setitem__(self, key: bytes, value: bytes) -> None:
-        if len(key) != self.ksize or len(value) != self.vsize:
-            raise ValueError("Key or value size does not match the defined sizes")
+    cdef uint8_t* _lookup_value(self, uint8_t* key_ptr) noexcept nogil:
+        """return a pointer to the value stored for key_ptr, NULL if not found."""
+        cdef size_t index
+        self.stats_get += 1
+        if self._lookup_index(key_ptr, &index):
+            return self.values + self.table[index] * self.vsize
+        return NULL
 
-        cdef uint8_t* key_ptr = <uint8_t*> key
-        cdef uint8_t* value_ptr = <uint8_t*> value
+    cdef size_t _find_free_index(self, uint8_t* key_ptr) noexcept nogil:
+        """return the index of the first free bucket in the probing sequence for key (used when rehashing)."""
+        cdef size_t index = self._get_index(key_ptr)
+        cdef uint64_t free_mask
+        while not (free_mask := bh_group_match(self.tags + index, FREE_TAG)):
+            index = (index + GROUP_SIZE) & self.mask
+        return (index + (bh_ctz64(free_mask) >> BH_GROUP_SHIFT)) & self.mask
+
+    cdef int _insert_raw(self, uint8_t* key_ptr, uint8_t* value_ptr) except -1 nogil:
+        """insert or update key_ptr -> value_ptr, both must point to ksize / vsize bytes."""
         cdef uint32_t kv_index
         cdef size_t index
         self.stats_set += 1
         if self._lookup_index(key_ptr, &index):
             kv_index = self.table[index]
-            memcpy(self.values + kv_index * self.vsize, value_ptr, self.vsize)
-            return
+            bh_copy(self.values + kv_index * self.vsize, value_ptr, self.vsize)
+            return 0
+        return self._insert_new(index, key_ptr, value_ptr)
 
+    cdef int _insert_new(self, size_t index, uint8_t* key_ptr, uint8_t* value_ptr) except -1 nogil:
+        """insert a new key_ptr -> value_ptr at index, a free bucket in the probing sequence of the key."""
+        cdef uint32_t kv_index
         if self.kv_used >= self.kv_capacity:
-            self._resize_kv(int(self.kv_capacity * self.kv_grow_factor))
+            self._resize_kv(<size_t> (self.kv_capacity * self.kv_grow_factor))
         if self.kv_used >= self.kv_capacity:
             # Should never happen. See "RESERVED" constant - we allow almost 4Gi kv entries.
             # For a typical 256-bit key and a small 32-bit value that would already consume 176GiB+
             # memory (plus spikes to even more when hashtable or kv arrays get resized).
-            raise RuntimeError("KV array is full")
+            with gil:
+                raise RuntimeError("KV array is full")
 
         kv_index = self.kv_used
-        memcpy(self.keys + kv_index * self.ksize, key_ptr, self.ksize)
-        memcpy(self.values + kv_index * self.vsize, value_ptr, self.vsize)
+        bh_copy(self.keys + kv_index * self.ksize, key_ptr, self.ksize)
+        bh_copy(self.values + kv_index * self.vsize, value_ptr, self.vsize)
         self.kv_used += 1
 
         self.used += 1
-        self.table[index] = kv_index  # _lookup_index has set index to a free bucket
+        self.table[index] = kv_index
+        self._set_tag(index, self._get_tag(key_ptr))
 
         if self.used + self.tombstones > self.capacity * self.max_load_factor:
-            self._resize_table(int(self.capacity * self.grow_factor))
+            if self.tombstones >= self.used:
+                # mostly tombstones: just get rid of them, without growing the table.
+                self._resize_table(self.capacity)
+            else:
+                self._resize_table(<size_t> (self.capacity * self.grow_factor))
+        return 0
+
+    def __setitem__(self, key: bytes|memoryview, value: bytes|memoryview) -> None:
+        if type(key) is bytes and type(value) is bytes:  # fast path for the usual case
+            if len(<bytes> key) != self.ksize or len(<bytes> value) != self.vsize:
+                raise ValueError("Key or value size does not match the defined sizes")
+            self._wait()
+            self._insert_raw(<uint8_t*> <bytes> key, <uint8_t*> <bytes> value)
+            return
+        # accept anything supporting the buffer protocol, so e.g. memoryview slices don't need to be copied.
+        cdef Py_buffer key_buf, value_buf
+        PyObject_GetBuffer(key, &key_buf, PyBUF_SIMPLE)
+        try:
+            PyObject_GetBuffer(value, &value_buf, PyBUF_SIMPLE)
+            try:
+                if key_buf.len != self.ksize or value_buf.len != self.vsize:
+                    raise ValueError("Key or value size does not match the defined sizes")
+                self._wait()  # getting the buffers might have run Python code
+                self._insert_raw(<uint8_t*> key_buf.buf, <uint8_t*> value_buf.buf)
+            finally:
+                PyBuffer_Release(&value_buf)
+        finally:
+            PyBuffer_Release(&key_buf)
 
     def __contains__(self, key: bytes) -> bool:
         if len(key) != self.ksize:
             raise ValueError("Key size does not match the defined size")
+        self._wait()
         return bool(self._lookup_index(<uint8_t*> key, NULL))
 
     def __getitem__(self, key: bytes) -> bytes:
         if len(key) != self.ksize:
             raise ValueError("Key size does not match the defined size")
-        cdef uint32_t kv_index
-        cdef size_t index
-        self.stats_get += 1
-        if self._lookup_index(<uint8_t*> key, &index):
-            kv_index = self.table[index]
-            return self.values[kv_index * self.vsize:(kv_index + 1) * self.vsize]
-        else:
+        self._wait()
+        cdef uint8_t* value_ptr = self._lookup_value(<uint8_t*> key)
+        if value_ptr == NULL:
             raise KeyError("Key not found")
+        return value_ptr[:self.vsize]
 
     def __delitem__(self, key: bytes) -> None:
         if len(key) != self.ksize:
             raise ValueError("Key size does not match the defined size")
+        self._wait()
         cdef uint8_t* key_ptr = <uint8_t*> key
         cdef size_t index
         cdef uint32_t kv_index
+        cdef uint64_t free_before, free_after
 
         self.stats_del += 1
         if self._lookup_index(key_ptr, &index):
             kv_index = self.table[index]
             memset(self.keys + kv_index * self.ksize, 0, self.ksize)
             memset(self.values + kv_index * self.vsize, 0, self.vsize)
-            self.table[index] = TOMBSTONE_BUCKET
             self.used -= 1
-            self.tombstones += 1
+            # A lookup only continues with the next group if the current one has no free bucket.
+            # If the run of non-free buckets around index is shorter than a group, no lookup has ever
+            # probed past this bucket, so it can be made free again instead of becoming a tombstone.
+            free_before = bh_group_match(self.tags + ((index - GROUP_SIZE) & self.mask), FREE_TAG)
+            free_after = bh_group_match(self.tags + index, FREE_TAG)
+            if free_before and free_after and \
+                    bh_group_tail(free_before) + bh_group_head(free_after) < GROUP_SIZE:
+                self.table[index] = FREE_BUCKET
+                self._set_tag(index, FREE_TAG)
+            else:
+                self.table[index] = TOMBSTONE_BUCKET
+                self._set_tag(index, TOMBSTONE_TAG)
+                self.tombstones += 1
 
             # Resize down if necessary
             if self.used < self.capacity * self.min_load_factor:
@@ -226,9 +561,89 @@ cdef class HashTable:
             del self[key]
             return value
 
+    def update_many(self, const uint8_t[::1] keys, const uint8_t[::1] values) -> None:
+        """
+        Insert or update many kv pairs at once.
+
+        keys / values are contiguous buffers (e.g. bytes) of N concatenated keys / values.
+        This is much faster than setting the items one by one, as it runs as a single C loop.
+        """
+        cdef size_t keys_len = len(keys), values_len = len(values)
+        cdef size_t n = keys_len // self.ksize
+        if keys_len != n * self.ksize or values_len != n * self.vsize:
+            raise ValueError("Keys or values buffer size does not match the defined sizes")
+        if n == 0:
+            return
+        cdef uint8_t* key_ptr = <uint8_t*> &keys[0]
+        cdef uint8_t* value_ptr = <uint8_t*> &values[0]
+        cdef size_t i, index, used_before = self.used, expected
+        cdef uint8_t* k
+        cdef uint8_t* v
+        self._begin_nogil_op()
+        try:
+            with nogil:
+                for i in range(n):
+                    if i + PREFETCH_DISTANCE < n:
+                        self._prefetch(key_ptr + (i + PREFETCH_DISTANCE) * self.ksize)
+                    # like _insert_raw, but deciding about growing the table in between.
+                    k = key_ptr + i * self.ksize
+                    v = value_ptr + i * self.vsize
+                    self.stats_set += 1
+                    if self._lookup_index(k, &index):
+                        bh_copy(self.values + self.table[index] * self.vsize, v, self.vsize)
+                        continue
+                    if self.used + self.tombstones + 1 > self.capacity * self.max_load_factor \
+                            and self.tombstones < self.used and i > 0:
+                        # this new key would make _insert_new grow the table. Instead of growing it
+                        # several times, grow it once for the new keys we expect, assuming that the rest
+                        # of the keys is new in the same proportion as the keys so far (so updating the
+                        # values of existing keys does not grow the table).
+                        expected = self.used + (self.used - used_before) * (n - i) // i
+                        self._resize_table(max(<size_t> (self.capacity * self.grow_factor),
+                                               <size_t> (expected / self.max_load_factor) + 1))
+                        index = self._find_free_index(k)  # the table was rehashed
+                    self._insert_new(index, k, v)
+        finally:
+            self._end_nogil_op()
+
+    def lookup_many(self, const uint8_t[::1] keys, uint8_t[::1] out) -> None:
+        """
+        Look up many keys at once.
+
+        keys is a contiguous buffer (e.g. bytes) of N concatenated keys,
+        out is a writable contiguous buffer (e.g. bytearray) receiving the N concatenated values,
+        so no bytes object is created per value.
+        If a key is not found, KeyError is raised (and out is only partially filled).
+        """
+        cdef size_t keys_len = len(keys), out_len = len(out)
+        cdef size_t n = keys_len // self.ksize
+        if keys_len != n * self.ksize or out_len != n * self.vsize:
+            raise ValueError("Keys or output buffer size does not match the defined sizes")
+        if n == 0:
+            return
+        cdef uint8_t* key_ptr = <uint8_t*> &keys[0]
+        cdef uint8_t* out_ptr = &out[0]
+        cdef uint8_t* value_ptr = NULL
+        cdef size_t i
+        self._begin_nogil_op()
+        try:
+            with nogil:
+                for i in range(n):
+                    if i + PREFETCH_DISTANCE < n:
+                        self._prefetch(key_ptr + (i + PREFETCH_DISTANCE) * self.ksize)
+                    value_ptr = self._lookup_value(key_ptr + i * self.ksize)
+                    if value_ptr == NULL:
+                        break
+                    bh_copy(out_ptr + i * self.vsize, value_ptr, self.vsize)
+        finally:
+            self._end_nogil_op()
+        if value_ptr == NULL:
+            raise KeyError("Key not found")
+
     def items(self) -> Iterator[tuple[bytes, bytes]]:
         cdef size_t i
         cdef uint32_t kv_index
+        self._wait()
         self.stats_iter += 1
         for i in range(self.capacity):
             kv_index = self.table[i]
@@ -236,37 +651,114 @@ cdef class HashTable:
                 key = self.keys[kv_index * self.ksize:(kv_index + 1) * self.ksize]
                 value = self.values[kv_index * self.vsize:(kv_index + 1) * self.vsize]
                 yield key, value
+                self._wait()  # other threads might have used the HashTable meanwhile
+
+    def items_many(self) -> tuple[bytes, bytes]:
+        """
+        Get all items at once, as two contiguous buffers of the N concatenated keys / values (in .items() order).
 
-    cdef void _resize_table(self, size_t new_capacity):
+        This is the counterpart of update_many(): no bytes object is created per key / value, and the
+        buffers can be processed in bulk, e.g. by struct.iter_unpack() or numpy.frombuffer().
+        """
+        self._wait()
+        cdef bytes keys = PyBytes_FromStringAndSize(NULL, self.used * self.ksize)
+        cdef bytes values = PyBytes_FromStringAndSize(NULL, self.used * self.vsize)
+        cdef uint8_t* key_ptr = <uint8_t*> PyBytes_AS_STRING(keys)
+        cdef uint8_t* value_ptr = <uint8_t*> PyBytes_AS_STRING(values)
+        cdef size_t i
+        cdef uint32_t kv_index
+        self.stats_iter += 1
+        for i in range(self.capacity):
+            kv_index = self.table[i]
+            if kv_index not in (FREE_BUCKET, TOMBSTONE_BUCKET):
+                bh_copy(key_ptr, self.keys + kv_index * self.ksize, self.ksize)
+                bh_copy(value_ptr, self.values + kv_index * self.vsize, self.vsize)
+                key_ptr += self.ksize
+                value_ptr += self.vsize
+        return keys, values
+
+    def _export_items(self, uint8_t[::1] out, size_t start) -> tuple[int, int]:
+        """
+        Copy items (in the same order as .items()) to out as concatenated key + value records,
+        starting from bucket index start, as many as fit into out. Used for serialization.
+        Return the count of copied items and the bucket index to continue from.
+        """
+        self._wait()
+        cdef size_t record_size = self.ksize + self.vsize
+        cdef size_t n = <size_t> len(out) // record_size, count = 0
+        cdef size_t i = start
+        cdef uint32_t kv_index
+        cdef uint8_t* out_ptr
+        while i < self.capacity and count < n:
+            kv_index = self.table[i]
+            if kv_index not in (FREE_BUCKET, TOMBSTONE_BUCKET):
+                out_ptr = &out[count * record_size]
+                bh_copy(out_ptr, self.keys + kv_index * self.ksize, self.ksize)
+                bh_copy(out_ptr + self.ksize, self.values + kv_index * self.vsize, self.vsize)
+                count += 1
+            i += 1
+        return count, i
+
+    cdef int _resize_table(self, size_t new_capacity) except -1 nogil:
         cdef size_t i, index
         cdef uint32_t kv_index
+        cdef uint32_t* old_table = self.table
+        cdef uint8_t* old_tags = self.tags
+        cdef size_t old_capacity = self.capacity
+        # capacity is a power of 2, so we can compute indexes with "& mask" instead of a (slow) "% capacity".
+        new_capacity = _next_pow2(max(new_capacity, GROUP_SIZE))
+        if new_capacity == 0 or new_capacity > SIZE_MAX // sizeof(uint32_t):
+            with gil:
+                raise MemoryError("hash table capacity is too big")
         cdef uint32_t* new_table = <uint32_t*> malloc(new_capacity * sizeof(uint32_t))
+        cdef uint8_t* new_tags = <uint8_t*> malloc((new_capacity + GROUP_SIZE - 1) * sizeof(uint8_t))
+        if new_table == NULL or new_tags == NULL:
+            free(new_table)
+            free(new_tags)
+            with gil:
+                raise MemoryError("could not allocate the hash table")
+        self.table = new_table
         for i in range(new_capacity):
-            new_table[i] = FREE_BUCKET
+            self.table[i] = FREE_BUCKET
+        self.tags = new_tags
+        memset(self.tags, FREE_TAG, (new_capacity + GROUP_SIZE - 1) * sizeof(uint8_t))
 
         self.stats_resize_table += 1
-        current_capacity = self.capacity
         self.capacity = new_capacity
-        for i in range(current_capacity):
-            kv_index = self.table[i]
+        self.mask = new_capacity - 1
+        for i in range(old_capacity):
+            kv_index = old_table[i]
             if kv_index not in (FREE_BUCKET, TOMBSTONE_BUCKET):
-                index = self._get_index(self.keys + kv_index * self.ksize)
-                while new_table[index] != FREE_BUCKET:
-                    index = (index + 1) % new_capacity
-                new_table[index] = kv_index
+                index = self._find_free_index(self.keys + kv_index * self.ksize)
+                self.table[index] = kv_index
+                self._set_tag(index, old_tags[i])  # the tag does not depend on the capacity
 
-        free(self.table)
-        self.table = new_table
+        free(old_table)
+        free(old_tags)
         self.tombstones = 0
+        return 0
 
-    cdef void _resize_kv(self, size_t new_capacity):
+    cdef int _resize_kv(self, size_t new_capacity) except -1 nogil:
         # We must never use kv indices >= RESERVED; thus, we'll never need more capacity either.
         cdef size_t capacity = min(new_capacity, <size_t> RESERVED - 1)
+        cdef uint8_t* keys
+        cdef uint8_t* values
         self.stats_resize_kv += 1
         # realloc is already highly optimized (in Linux). By using mremap internally only the peak address space usage is "old size" + "new size", while the peak memory usage is only "new size".
-        self.keys = <uint8_t*> realloc(self.keys, capacity * self.ksize * sizeof(uint8_t))
-        self.values = <uint8_t*> realloc(self.values, capacity * self.vsize * sizeof(uint8_t))
+        # If an allocation fails, the kv arrays keep their data and the capacity both of them still have.
+        keys = _realloc_aligned(&self.keys_mem, self.kv_used * self.ksize, capacity * self.ksize)
+        if keys == NULL:
+            with gil:
+                raise MemoryError("could not allocate the keys array")
+        self.keys = keys
+        values = _realloc_aligned(&self.values_mem, self.kv_used * self.vsize, capacity * self.vsize)
+        if values == NULL:
+            self.kv_capacity = <uint32_t> min(<size_t> self.kv_capacity, capacity)  # keys might have shrunk
+            with gil:
+                raise MemoryError("could not allocate the values array")
+        self.values = values
         self.kv_capacity = <uint32_t> capacity
+        return 0
 
     def k_to_idx(self, key: bytes) -> int:
         """
@@ -275,6 +767,7 @@ cdef class HashTable:
         """
         if len(key) != self.ksize:
             raise ValueError("Key size does not match the defined size")
+        self._wait()
         cdef size_t index
         if self._lookup_index(<uint8_t*> key, &index):
             return self.table[index]  # == uint32_t kv_index
@@ -287,6 +780,7 @@ cdef class HashTable:
         This is the reverse of k_to_idx (e.g., 32-bit index -> 256-bit key).
         """
         cdef uint32_t kv_index = <uint32_t> idx
+        self._wait()
         return self.keys[kv_index * self.ksize:(kv_index + 1) * self.ksize]
 
     def kv_to_idx(self, key: bytes, value: bytes) -> int:
@@ -298,6 +792,7 @@ cdef class HashTable:
             raise ValueError("Key size does not match the defined size")
         if len(value) != self.vsize:
             raise ValueError("Value size does not match the defined size")
+        self._wait()
         cdef size_t index
         cdef uint32_t kv_index
         if self._lookup_index(<uint8_t*> key, &index):
@@ -313,12 +808,14 @@ cdef class HashTable:
         This is the reverse of kv_to_idx (e.g., 32-bit index -> 256-bit key + 32-bit value).
         """
         cdef uint32_t kv_index = <uint32_t> idx
+        self._wait()
         key = self.keys[kv_index * self.ksize:(kv_index + 1) * self.ksize]
         value = self.values[kv_index * self.vsize:(kv_index + 1) * self.vsize]
         return key, value
 
     @property
     def stats(self) -> dict[str, int]:
+        self._wait()
         return {
             "get": self.stats_get,
             "set": self.stats_set,
@@ -326,6 +823,7 @@ cdef class HashTable:
             "iter": self.stats_iter,
             "lookup": self.stats_lookup,
             "linear": self.stats_linear,
+            "compare": self.stats_compare,
             "resize_table": self.stats_resize_table,
             "resize_kv": self.stats_resize_kv,
         }
@@ -1,8 +1,34 @@
+from libc.stdint cimport uint8_t
+
+from .HashTable cimport HashTable
+
+cdef enum:
+    MAX_UINT_FIELDS = 16  # max. count of value elements for the specialized unsigned int (un)packer
+
 cdef class HashTableNT:
     cdef int key_size
     cdef object byte_order
     cdef object value_type
     cdef object value_format
     cdef object value_struct
+    cdef object value_pack
+    cdef object value_pack_into
+    cdef object value_unpack
+    cdef object value_make
     cdef int value_size
-    cdef object inner
+    cdef int uint_fields
+    cdef uint8_t uint_sizes[MAX_UINT_FIELDS]  # byte sizes / offsets of the value elements, if uint_fields
+    cdef uint8_t uint_offsets[MAX_UINT_FIELDS]
+    cdef bint big_endian
+    cdef HashTable inner
+
+    cdef int _check_key(self, key) except -1
+    cdef _as_value_type(self, value)
+    cpdef bytes _to_binary_value(self, value)
+    cpdef _to_namedtuple_value(self, bytes binary_value)
+    cdef _value_from_ptr(self, const uint8_t* p)
+    cdef int _pack_value_into(self, value, bytearray buffer, Py_ssize_t offset) except -1
+    cdef int _pack_uint(self, value, uint8_t* p) except -1
+    cdef tuple _unpack_uint(self, const uint8_t* p)
+    cdef int _update(self, other, bint batch_iterables) except -1
+    cdef int _update_items(self, items) except -1
@@ -3,14 +3,23 @@ HashTableNT: wrapper around HashTable, providing namedtuple values and serializa
 """
 from __future__ import annotations
 
-from collections.abc import Mapping
+from collections.abc import Mapping, Sized
 from typing import BinaryIO, Iterator, Any
 
 from collections import namedtuple
 import json
 import struct
+import sys
 
-from .HashTable import HashTable, MIN_CAPACITY, _fill
+from libc.stdint cimport uint8_t, uint64_t
+from libc.string cimport memcpy
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+from cpython.tuple cimport PyTuple_New, PyTuple_GET_ITEM, PyTuple_SET_ITEM
+from cpython.ref cimport Py_INCREF
+from cpython.long cimport PyLong_Check
+
+from .HashTable cimport HashTable
+from .HashTable import MIN_CAPACITY
 
 MAGIC = b"BORGHASH"
 assert len(MAGIC) == 8
@@ -19,8 +28,26 @@ HEADER_FMT = "<8sII"  # magic, version, meta length
 
 BYTE_ORDER = dict(big=">", little="<", network="!", native="=")  # struct format chars
 
+UINT_SIZES = dict(B=1, H=2, I=4, Q=8)  # struct format chars of unsigned ints (standard sizes) we can (un)pack
+cdef Py_ssize_t UPDATE_BATCH = 1024  # .update() packs and inserts this many items at once
+cdef Py_ssize_t IO_BATCH = 4096  # .write() / .read() process this many items (key + value records) at once
+
 _NoDefault = object()
 
+
+cdef inline uint64_t _load_uint(const uint8_t* p, int size, bint big_endian):
+    """load an unsigned int of size bytes (1 .. 8) from p."""
+    cdef uint64_t v = 0
+    cdef int j
+    if big_endian:
+        for j in range(size):
+            v = v << 8 | p[j]
+    else:
+        for j in range(size - 1, -1, -1):
+            v = v << 8 | p[j]
+    return v
+
+
 cdef class HashTableNT:
     def __init__(self, items=None, *,
                  key_size: int, value_type: Any, value_format: Any,
@@ -43,29 +70,123 @@ cdef class HashTableNT:
         self.byte_order = byte_order
         self.value_struct = struct.Struct(BYTE_ORDER[byte_order] + "".join(value_format))
         self.value_size = self.value_struct.size
+        # bound methods, looking them up is more expensive than packing / unpacking small values.
+        self.value_pack = self.value_struct.pack
+        self.value_pack_into = self.value_struct.pack_into
+        self.value_unpack = self.value_struct.unpack
+        self.value_make = value_type._make  # faster than value_type(*values)
+        # values only consisting of unsigned ints are common, we have a faster (un)packer for these.
+        self.uint_fields = 0
+        if len(value_format) <= MAX_UINT_FIELDS and all(fmt in UINT_SIZES for fmt in value_format):
+            offset = 0
+            for i, fmt in enumerate(value_format):
+                self.uint_sizes[i] = UINT_SIZES[fmt]
+                self.uint_offsets[i] = offset
+                offset += UINT_SIZES[fmt]
+            self.uint_fields = len(value_format)
+        self.big_endian = byte_order in ("big", "network") or (byte_order == "native" and sys.byteorder == "big")
         self.inner = HashTable(key_size=self.key_size, value_size=self.value_size, capacity=capacity)
-        _fill(self, items)
+        if isinstance(items, Sized):
+            self.inner.reserve(len(items))
+        if items is not None:
+            self._update(items, True)  # nothing can read the new HashTableNT yet, we can batch any items.
 
     def clear(self) -> None:
         self.inner.clear()
 
-    def _check_key(self, key: bytes) -> None:
+    def reserve(self, n: int) -> None:
+        """Make room for n items (in total), see HashTable.reserve()."""
+        self.inner.reserve(n)
+
+    cdef int _check_key(self, key) except -1:
         if not isinstance(key, bytes):
             raise TypeError(f"Expected an instance of bytes, got {type(key)}")
-        if len(key) != self.key_size:
+        if len(<bytes> key) != self.key_size:
             raise ValueError(f"Key must be {self.key_size} bytes long")
+        return 0
 
-    def _to_binary_value(self, value: Any) -> bytes:
+    cdef _as_value_type(self, value):
         if not isinstance(value, self.value_type):
             if isinstance(value, tuple):
-                value = self.value_type(*value)
-            else:
-                raise TypeError(f"Expected an instance of {self.value_type}, got {type(value)}")
-        return self.value_struct.pack(*value)
+                return self.value_make(value)
+            raise TypeError(f"Expected an instance of {self.value_type}, got {type(value)}")
+        return value
+
+    cpdef bytes _to_binary_value(self, value: Any):
+        cdef bytes binary_value
+        value = self._as_value_type(value)
+        if self.uint_fields:
+            binary_value = PyBytes_FromStringAndSize(NULL, self.value_size)
+            try:
+                self._pack_uint(value, <uint8_t*> PyBytes_AS_STRING(binary_value))
+                return binary_value
+            except (TypeError, OverflowError):
+                pass  # invalid value, let struct raise its usual exception
+        return self.value_pack(*value)
+
+    cdef int _pack_value_into(self, value, bytearray buffer, Py_ssize_t offset) except -1:
+        """like _to_binary_value, but pack the value into buffer at offset."""
+        value = self._as_value_type(value)
+        if self.uint_fields:
+            try:
+                return self._pack_uint(value, <uint8_t*> buffer + offset)
+            except (TypeError, OverflowError):
+                pass  # invalid value, let struct raise its usual exception
+        self.value_pack_into(buffer, offset, *value)
+        return 0
+
+    cpdef _to_namedtuple_value(self, bytes binary_value):
+        if self.uint_fields:
+            if len(binary_value) != self.value_size:
+                raise struct.error(f"unpack requires a buffer of {self.value_size} bytes")
+            return self.value_make(self._unpack_uint(<uint8_t*> PyBytes_AS_STRING(binary_value)))
+        return self.value_make(self.value_unpack(binary_value))
+
+    cdef _value_from_ptr(self, const uint8_t* p):
+        """
+        like _to_namedtuple_value, p must point to value_size bytes (e.g. a value in the HashTable).
 
-    def _to_namedtuple_value(self, binary_value: bytes) -> Any:
-        unpacked_data = self.value_struct.unpack(binary_value)
-        return self.value_type(*unpacked_data)
+        p is read before creating any GC tracked object: that could run a garbage collection, finalizers
+        and other threads, which might move the values array of the HashTable (and p would dangle).
+        """
+        if self.uint_fields:
+            return self.value_make(self._unpack_uint(p))
+        cdef bytes binary_value = p[:self.value_size]  # a bytes object is not tracked by the GC
+        return self.value_make(self.value_unpack(binary_value))
+
+    cdef int _pack_uint(self, value, uint8_t* p) except -1:
+        """value must be an instance of value_type (a tuple subclass with uint_fields elements)."""
+        cdef uint64_t v
+        cdef int i, j, size
+        for i in range(self.uint_fields):
+            item = <object> PyTuple_GET_ITEM(value, i)
+            if not PyLong_Check(item):
+                raise TypeError("not an integer")  # C conversion would accept and truncate a float
+            v = item  # raises OverflowError if < 0 or >= 2**64
+            size = self.uint_sizes[i]
+            if size < 8 and v >> (8 * size):
+                raise OverflowError("integer out of range")
+            if self.big_endian:
+                for j in range(size):
+                    p[size - 1 - j] = <uint8_t> (v >> (8 * j))
+            else:
+                for j in range(size):
+                    p[j] = <uint8_t> (v >> (8 * j))
+            p += size
+        return 0
+
+    cdef tuple _unpack_uint(self, const uint8_t* p):
+        cdef int i
+        cdef object v
+        cdef uint64_t loaded[MAX_UINT_FIELDS]
+        for i in range(self.uint_fields):  # read p before creating any objects, see _value_from_ptr
+            loaded[i] = _load_uint(p + self.uint_offsets[i], self.uint_sizes[i], self.big_endian)
+        cdef tuple values = PyTuple_New(self.uint_fields)
+        for i in range(self.uint_fields):
+            v = loaded[i]
+            Py_INCREF(v)  # PyTuple_SET_ITEM steals a reference
+            PyTuple_SET_ITEM(values, i, v)
+        return values
 
     def _set_raw(self, key: bytes, value: bytes) -> None:
         self.inner[key] = value
@@ -75,12 +196,17 @@ cdef class HashTableNT:
 
     def __setitem__(self, key: bytes, value: Any) -> None:
         self._check_key(key)
-        self.inner[key] = self._to_binary_value(value)
+        cdef bytes binary_value = self._to_binary_value(value)
+        self.inner._wait()
+        self.inner._insert_raw(<uint8_t*> key, <uint8_t*> binary_value)
 
     def __getitem__(self, key: bytes) -> Any:
         self._check_key(key)
-        binary_value = self.inner[key]
-        return self._to_namedtuple_value(binary_value)
+        self.inner._wait()
+        cdef uint8_t* value_ptr = self.inner._lookup_value(<uint8_t*> key)
+        if value_ptr == NULL:
+            raise KeyError("Key not found")
+        return self._value_from_ptr(value_ptr)
 
     def __delitem__(self, key: bytes) -> None:
         self._check_key(key)
@@ -88,23 +214,32 @@ cdef class HashTableNT:
 
     def __contains__(self, key: bytes) -> bool:
         self._check_key(key)
-        return key in self.inner
+        self.inner._wait()
+        return bool(self.inner._lookup_index(<uint8_t*> key, NULL))
 
     def items(self) -> Iterator[tuple[bytes, Any]]:
         for key, binary_value in self.inner.items():
             yield (key, self._to_namedtuple_value(binary_value))
 
+    def items_many(self) -> tuple[bytes, bytes]:
+        """
+        Get all items at once, see HashTable.items_many().
+
+        The values are in their binary form, as packed by struct using byte_order and value_format,
+        so no namedtuple is created per value.
+        """
+        return self.inner.items_many()
+
     def __len__(self) -> int:
         return len(self.inner)
 
     def get(self, key: bytes, default: Any = None) -> Any:
         self._check_key(key)
-        try:
-            binary_value = self.inner[key]
-        except KeyError:
+        self.inner._wait()
+        cdef uint8_t* value_ptr = self.inner._lookup_value(<uint8_t*> key)
+        if value_ptr == NULL:
             return default
-        else:
-            return self._to_namedtuple_value(binary_value)
+        return self._value_from_ptr(value_ptr)
 
     def setdefault(self, key: bytes, default: Any) -> Any:
         self._check_key(key)
@@ -124,21 +259,59 @@ cdef class HashTableNT:
             return self._to_namedtuple_value(binary_value)
 
     def update(self, other=(), /, **kwds):
-        """Like dict.update(), but 'other' can also be a HashTableNT instance."""
+        """
+        Like dict.update(), but 'other' can also be a HashTableNT instance.
+
+        Items from a HashTableNT, a Mapping, a list or a tuple are inserted in batches. Other iterables
+        (e.g. generators) are inserted item by item, so they see the items they produced before.
+        """
+        self._update(other, False)
+        if kwds:
+            self._update_items(kwds.items())
+
+    cdef int _update(self, other, bint batch_iterables) except -1:
         if isinstance(other, HashTableNT):
-            for key, value in other.items():
-                self[key] = value
+            if (<HashTableNT> other).value_struct.format == self.value_struct.format:
+                # same binary values, no need to unpack and pack them again.
+                for key, binary_value in (<HashTableNT> other).inner.items():
+                    self.inner[key] = binary_value
+            else:
+                self._update_items(other.items())
         elif isinstance(other, Mapping):
-            for key in other:
-                self[key] = other[key]
+            self._update_items(other.items())
         elif hasattr(other, "keys"):
             for key in other.keys():
                 self[key] = other[key]
+        elif batch_iterables or isinstance(other, (list, tuple)):
+            self._update_items(other)
         else:
+            # other might read this HashTableNT while we consume it (e.g. computing new refcounts from the
+            # current ones), so we must not hold back the items in a batch.
             for key, value in other:
                 self[key] = value
-        for key, value in kwds.items():
-            self[key] = value
+        return 0
+
+    cdef int _update_items(self, items) except -1:
+        """insert (key, value) items in batches: pack them into buffers, then insert them via update_many."""
+        cdef bytearray keys = bytearray(UPDATE_BATCH * self.key_size)
+        cdef bytearray values = bytearray(UPDATE_BATCH * self.value_size)
+        cdef uint8_t* keys_ptr = keys
+        cdef Py_ssize_t n = 0
+        try:
+            for key, value in items:
+                self._check_key(key)
+                memcpy(keys_ptr + n * self.key_size, PyBytes_AS_STRING(key), self.key_size)
+                self._pack_value_into(value, values, n * self.value_size)
+                n += 1
+                if n == UPDATE_BATCH:
+                    n = 0  # if update_many raises, the finally clause must not insert this batch again
+                    self.inner.update_many(keys, values)
+        finally:
+            # like dict.update, keep the items preceding an invalid one.
+            if n:
+                self.inner.update_many(memoryview(keys)[:n * self.key_size],
+                                       memoryview(values)[:n * self.value_size])
+        return 0
 
     def k_to_idx(self, key: bytes) -> int:
         return self.inner.k_to_idx(key)
@@ -183,12 +356,16 @@ cdef class HashTableNT:
         header_bytes = struct.pack(HEADER_FMT, MAGIC, VERSION, meta_size)
         fd.write(header_bytes)
         fd.write(meta_bytes)
-        count = 0
-        for key, value in self.inner.items():
-            fd.write(key)
-            fd.write(value)
-            count += 1
-        assert count == self.inner.used
+        cdef Py_ssize_t record_size = self.key_size + self.value_size
+        buffer = bytearray(IO_BATCH * record_size)
+        total = start = 0
+        while True:
+            count, start = self.inner._export_items(buffer, start)
+            if not count:
+                break
+            fd.write(memoryview(buffer)[:count * record_size])
+            total += count
+        assert total == self.inner.used
 
     @classmethod
     def read(cls, file: BinaryIO|str|bytes):
@@ -216,14 +393,27 @@ cdef class HashTableNT:
         value_type = namedtuple(meta['value_type_name'], meta['value_type_fields'])
         value_format_t = namedtuple(meta['value_format_name'], meta['value_format_fields'])
         value_format = value_format_t(*meta['value_format'])
-        ht = cls(key_size=meta['key_size'], value_format=value_format, value_type=value_type,
-                 capacity=meta['capacity'], byte_order=meta['byte_order'])
-        count = 0
-        ksize, vsize = meta['key_size'], meta['value_size']
-        for i in range(meta['used']):
-            key = fd.read(ksize)
-            value = fd.read(vsize)
-            ht._set_raw(key, value)
+        cdef HashTableNT ht = cls(key_size=meta['key_size'], value_format=value_format, value_type=value_type,
+                                  capacity=meta['capacity'], byte_order=meta['byte_order'])
+        cdef Py_ssize_t ksize = meta['key_size'], vsize = meta['value_size']
+        cdef Py_ssize_t remaining = meta['used'], count, i
+        # the file has interleaved keys and values, split them into separate buffers for update_many.
+        cdef bytearray keys = bytearray(IO_BATCH * ksize)
+        cdef bytearray values = bytearray(IO_BATCH * vsize)
+        cdef bytes data
+        cdef const uint8_t* p
+        while remaining > 0:
+            count = min(remaining, IO_BATCH)
+            data = fd.read(count * (ksize + vsize))
+            if len(data) < count * (ksize + vsize):
+                raise ValueError(f"Invalid file, file is too short.")
+            p = <const uint8_t*> PyBytes_AS_STRING(data)
+            for i in range(count):
+                memcpy(<uint8_t*> keys + i * ksize, p, ksize)
+                memcpy(<uint8_t*> values + i * vsize, p + ksize, vsize)
+                p += ksize + vsize
+            ht.inner.update_many(memoryview(keys)[:count * ksize], memoryview(values)[:count * vsize])
+            remaining -= count
         return ht
 
     def size(self) -> int:
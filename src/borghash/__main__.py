@@ -1,8 +1,69 @@
 """
 Demonstration of BorgHash.
 """
+import sys
 
-def demo():
+
+def pgo_workload(count: int = 1000000) -> None:
+    """
+    Deterministic workload for training a profile-guided build (see BORGHASH_PGO in the README).
+
+    count operations: ~70% lookups (mostly hits, some misses), ~20% inserts, ~10% deletes,
+    done per item, followed by the bulk operations and serialization.
+    """
+    from io import BytesIO
+    from collections import namedtuple
+    from random import Random
+    from time import time
+
+    from .HashTable import HashTable
+    from .HashTableNT import HashTableNT
+
+    rng = Random(0)
+    value_type = namedtuple("Chunk", ["refcount", "size"])
+    value_format = value_type(refcount="I", size="I")
+    ht = HashTableNT(key_size=32, value_type=value_type, value_format=value_format)
+    keys = []  # the keys currently in ht
+    t0 = time()
+    for i in range(count):
+        op = rng.random()
+        if op < 0.7 and keys:
+            key = keys[rng.randrange(len(keys))] if op < 0.6 else rng.randbytes(32)
+            ht.get(key)
+        elif op < 0.9 or not keys:
+            key = rng.randbytes(32)
+            ht[key] = value_type(refcount=1, size=i)
+            keys.append(key)
+        else:
+            index = rng.randrange(len(keys))
+            keys[index], keys[-1] = keys[-1], keys[index]
+            del ht[keys.pop()]
+    assert len(ht) == len(keys)
+
+    t1 = time()
+    raw = HashTable(key_size=32, value_size=4)
+    all_keys = rng.randbytes(32 * count)
+    raw.update_many(all_keys, bytes(4 * count))
+    out = bytearray(4 * count)
+    raw.lookup_many(all_keys, out)
+    raw.items_many()
+
+    t2 = time()
+    with BytesIO() as f:
+        ht.write(f)
+        f.seek(0)
+        ht_read = HashTableNT.read(f)
+    assert len(ht_read) == len(ht)
+
+    t3 = time()
+    print(f"PGO workload (count={count}): per item ops: {t1-t0:.3f}s, bulk ops: {t2-t1:.3f}s, "
+          f"serialization: {t3-t2:.3f}s.")
+
+
+def demo(pgo: bool = False):
+    if pgo:
+        pgo_workload()
+        return
     print("BorgHash demo")
     print("=============")
     print("Code:")
@@ -66,4 +127,4 @@ print(f"HashTableNT serialization (count={count}): write: {t3-t2:.3f}s, read: {t
 
 
 if __name__ == "__main__":
-    demo()
+    demo(pgo="--pgo" in sys.argv[1:])
@@ -1,5 +1,7 @@
+import os
 import struct
 import random
+import threading
 
 import pytest
 
@@ -54,6 +56,21 @@ def test_many_collisions_stress(ht):
     check(ht, pydict, destructive=True)
 
 
+def test_many_collisions_churn(ht):
+    # Deleting colliding keys leaves tombstones, which must not make the hash table grow without bounds.
+    pydict = {}
+    for h in range(2000):
+        key = H(0, h)
+        ht[key] = pydict[key] = key[-4:]
+    capacity = ht.capacity
+    for h in range(2000, 20000):
+        del pydict[H(0, h - 2000)], ht[H(0, h - 2000)]
+        key = H(0, h)
+        ht[key] = pydict[key] = key[-4:]
+        assert ht.capacity <= 2 * capacity
+    check(ht, pydict, destructive=True)
+
+
 @pytest.mark.parametrize("delete_threshold", [0, 10, 100, 1000, 10000])
 def test_ht_vs_dict_stress(ht, delete_threshold):
     SET, GET, DELETE = 0, 1, 2
@@ -92,3 +109,59 @@ def test_ht_vs_dict_stress(ht, delete_threshold):
         random_operations(ht, pydict)
         check(ht, pydict, destructive=False)
     check(ht, pydict, destructive=True)
+
+
+def test_threads(ht):
+    # update_many / lookup_many release the GIL, other threads using the same HashTable must wait for them.
+    n = 2000  # keys per thread doing bulk operations
+    m = 40000  # keys set / deleted one by one, enough to make ht grow and (deleting them) shrink again
+    keys = [os.urandom(32) for _ in range(3 * n + m)]
+    pydict = {key: key[-4:] for key in keys}
+    errors = []
+    capacities = []
+    setdel_done = threading.Event()
+
+    def run(func, keys):
+        try:
+            func(keys)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    def bulk_update(keys):
+        while not setdel_done.is_set():
+            for i in range(0, n, 1000):
+                ht.update_many(b"".join(keys[i:i + 1000]), b"".join(pydict[key] for key in keys[i:i + 1000]))
+
+    def bulk_lookup(keys):
+        # a tight loop of bulk operations must not starve the other threads.
+        out = bytearray(4 * n)
+        while not setdel_done.is_set():
+            ht.lookup_many(b"".join(keys), out)
+            assert out == b"".join(pydict[key] for key in keys)
+
+    def single_setdel(keys):
+        try:
+            for key in keys:
+                ht[key] = pydict[key]
+            capacities.append(ht.capacity)
+            for key in keys:
+                del ht[key]  # less than 3 * n keys are left: ht shrinks (rehashes)
+            capacities.append(ht.capacity)
+            for key in keys[::2]:
+                ht[key] = pydict[key]
+            for key in keys[1::2]:
+                del pydict[key]
+        finally:
+            setdel_done.set()
+
+    ht.update_many(b"".join(keys[:n]), b"".join(pydict[key] for key in keys[:n]))
+    threads = [threading.Thread(target=run, args=args)
+               for args in [(bulk_lookup, keys[:n]), (bulk_update, keys[n:2 * n]),
+                            (single_setdel, keys[3 * n:]), (bulk_update, keys[2 * n:3 * n])]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert capacities[1] < capacities[0]
+    check(ht, pydict)
@@ -52,6 +52,15 @@ def test_insert_lookup(ht12):
     assert ht12[key2] == value2
 
 
+def test_insert_buffers(ht):
+    ht[memoryview(key1)] = memoryview(b"xx" + value1)[2:]
+    ht[bytearray(key2)] = bytearray(value2)
+    assert ht[key1] == value1
+    assert ht[key2] == value2
+    with pytest.raises(ValueError):
+        ht[memoryview(key3)[1:]] = value3
+
+
 def test_remove_lookup(ht12):
     del ht12[key1]
     with pytest.raises(KeyError):
@@ -62,6 +71,124 @@ def test_remove_lookup(ht12):
         ht12[key2]
 
 
+@pytest.mark.parametrize("count", [5, 40])  # shorter / longer than a probing group
+def test_remove_colliding(count):
+    ht = HashTable(key_size=32, value_size=4, min_load_factor=0.0)  # no shrinking (rehashing) in __delitem__
+    # all keys start with the same 32 bits, so they have the same home bucket.
+    keys = [bytes(4) + H2(x)[4:] for x in range(count)]
+    for key in keys:
+        ht[key] = key[-4:]
+    # deleted buckets in front of a key (freed or tombstoned) must not hide it.
+    for key in keys[1::2]:
+        del ht[key]
+    for key in keys[::2]:
+        assert ht[key] == key[-4:]
+    for key in keys[1::2]:
+        assert key not in ht
+        ht[key] = key[-4:]
+    for key in keys:
+        assert ht[key] == key[-4:]
+    assert len(ht) == count
+
+
+def test_reserve(ht12):
+    n = 10000
+    ht12.reserve(n)
+    resizes = ht12.stats["resize_table"], ht12.stats["resize_kv"]
+    ht12.update_many(b"".join(H2(i) for i in range(n // 2)), bytes(4 * (n // 2)))
+    for i in range(n // 2, n - 2):
+        ht12[H2(i)] = bytes(4)
+    assert len(ht12) == n
+    assert (ht12.stats["resize_table"], ht12.stats["resize_kv"]) == resizes
+    ht12.reserve(n // 2)  # never shrinks
+    assert (ht12.stats["resize_table"], ht12.stats["resize_kv"]) == resizes
+    assert ht12[key1] == value1 and ht12[H2(n - 3)] == bytes(4)
+
+
+def test_reserve_invalid(ht12):
+    with pytest.raises(ValueError):
+        ht12.reserve(-1)
+    with pytest.raises(MemoryError):
+        ht12.reserve(2**62)  # too big for the hash table (but must not hang)
+    assert len(ht12) == 2 and ht12[key1] == value1
+    ht12[key3] = value3
+    assert ht12[key3] == value3
+
+
+def test_reserve_kv_memory_error():
+    key_size = 2**26  # huge keys: the kv arrays can not be allocated, the hash table can.
+    ht = HashTable(key_size=key_size, value_size=4, capacity=16)
+    key = b"k" * key_size
+    ht[key] = value1
+    with pytest.raises(MemoryError):
+        ht.reserve(2**22)  # 2**48 bytes of keys (more than the usual user address space)
+    # the kv arrays are unchanged and still usable.
+    assert ht[key] == value1
+    ht[key] = value2
+    assert len(ht) == 1 and ht[key] == value2
+
+
+def test_update_many(ht12):
+    ht12.update_many(key1 + key3, value2 + value3)
+    assert len(ht12) == 3
+    assert ht12[key1] == value2
+    assert ht12[key2] == value2
+    assert ht12[key3] == value3
+    ht12.update_many(b"", b"")
+    assert len(ht12) == 3
+    with pytest.raises(ValueError):
+        ht12.update_many(key1 + key3, value1)
+    with pytest.raises(ValueError):
+        ht12.update_many(key1[:-1], value1)
+
+
+def test_update_many_growth(ht):
+    n = 10000
+    keys = b"".join(H2(i) for i in range(n))
+    ht.update_many(keys, bytes(4 * n))
+    assert ht.stats["resize_table"] <= 2  # grown once for the expected count, not once per doubling
+    resizes = ht.stats["resize_table"]
+    ht.update_many(keys, b"X" * (4 * n))  # only existing keys: no need to grow
+    assert ht.stats["resize_table"] == resizes
+    assert len(ht) == n and ht[H2(n - 1)] == b"XXXX"
+
+
+def test_update_many_growth_at_threshold():
+    # a table with exactly as many keys as it can hold without growing must not grow when these are updated.
+    ht = HashTable(key_size=32, value_size=4)
+    n = int(ht.capacity * 0.5)  # max_load_factor
+    for i in range(n):
+        ht[H2(i)] = bytes(4)
+    capacity, resizes = ht.capacity, ht.stats["resize_table"]
+    ht.update_many(b"".join(H2(i) for i in range(n)), b"X" * (4 * n))
+    assert (ht.capacity, ht.stats["resize_table"]) == (capacity, resizes)
+    ht.update_many(H2(n), bytes(4))  # a new key grows the table, as usual
+    assert ht.capacity > capacity
+
+
+def test_lookup_many(ht12):
+    out = bytearray(2 * 4)
+    ht12.lookup_many(key2 + key1, out)
+    assert out == value2 + value1
+    ht12.lookup_many(b"", bytearray())
+    with pytest.raises(KeyError):
+        ht12.lookup_many(key1 + key3, out)
+    with pytest.raises(ValueError):
+        ht12.lookup_many(key1, out)
+
+
+def test_items_many(ht12):
+    ht12[key3] = value3
+    del ht12[key2]
+    keys, values = ht12.items_many()
+    items = list(ht12.items())
+    assert keys == b"".join(k for k, v in items)
+    assert values == b"".join(v for k, v in items)
+    assert sorted(zip([keys[:32], keys[32:]], [values[:4], values[4:]])) == [(key1, value1), (key3, value3)]
+    ht12.clear()
+    assert ht12.items_many() == (b"", b"")
+
+
 def test_items(ht12):
     items = set(ht12.items())
     assert (key1, value1) in items
@@ -116,15 +243,18 @@ def test_stats(ht):
     assert ht.stats["iter"] == 0
     assert ht.stats["lookup"] == 0
     assert ht.stats["linear"] == 0
+    assert ht.stats["compare"] == 0
     assert ht.stats["resize_table"] == 0
     assert ht.stats["resize_table"] == 0
     assert ht.stats["resize_kv"] == 0
     ht[key1] = value1
     assert ht.stats["set"] == 1
     assert ht.stats["lookup"] == 1
+    assert ht.stats["compare"] == 0
     ht[key1]
     assert ht.stats["get"] == 1
     assert ht.stats["lookup"] == 2
+    assert ht.stats["compare"] == 1
     del ht[key1]
     assert ht.stats["del"] == 1
     assert ht.stats["lookup"] == 3
@@ -132,6 +262,31 @@ def test_stats(ht):
     assert ht.stats["iter"] == 1
 
 
+def test_tags(ht):
+    # full keys are only compared if the tag in the bucket matches.
+    ht.update_many(b"".join(H2(i) for i in range(10000)), bytes(4 * 10000))
+    compares = ht.stats["compare"]
+    for i in range(10000):
+        assert H2(i) in ht
+    assert 10000 <= ht.stats["compare"] - compares < 10100
+    compares = ht.stats["compare"]
+    for i in range(10000, 20000):
+        assert H2(i) not in ht
+    assert ht.stats["compare"] - compares < 500  # tag collisions: < 5% of the lookups of missing keys
+
+
+def test_tags_short_keys():
+    # with 4-byte keys, the tag must not be taken from the bytes used for the home bucket either.
+    ht = HashTable(key_size=4, value_size=4)
+    keys = list(dict.fromkeys(H2(i)[:4] for i in range(20000)))  # unique keys
+    present, missing = keys[:10000], keys[10000:]
+    ht.update_many(b"".join(present), bytes(4 * len(present)))
+    compares = ht.stats["compare"]
+    for key in missing:
+        assert key not in ht
+    assert ht.stats["compare"] - compares < 0.05 * len(missing)
+
+
 def test_k_to_idx(ht12):
     idx1 = ht12.k_to_idx(key1)
     idx2 = ht12.k_to_idx(key2)
@@ -1,5 +1,6 @@
 from collections import namedtuple
 from io import BytesIO
+import struct
 
 import pytest
 
@@ -62,6 +63,13 @@ def test_items(ntht12):
     assert (key2, value2) in items
 
 
+def test_items_many(ntht12):
+    keys, values = ntht12.items_many()
+    items = list(ntht12.items())
+    assert [keys[i:i + key_size] for i in range(0, len(keys), key_size)] == [k for k, v in items]
+    assert [value_type(*v) for v in struct.iter_unpack("<III", values)] == [v for k, v in items]
+
+
 def test_len(ntht12):
     assert len(ntht12) == 2
 
@@ -93,6 +101,51 @@ def test_pop(ntht12):
     assert ntht12.pop(key3, None) is None
 
 
+def test_tuple_values(ntht):
+    # plain tuples are accepted as values, but we always return value_type instances.
+    ntht[key1] = tuple(value1)
+    assert ntht[key1] == value1
+    assert type(ntht[key1]) == value_type
+    for invalid_value in [(1, 2), (1, 2, 3, 4)]:
+        with pytest.raises(TypeError):
+            ntht[key2] = invalid_value
+    assert key2 not in ntht
+
+
+@pytest.mark.parametrize("fmt", ["III", "QQQ", "BHQ"])
+@pytest.mark.parametrize("byte_order", ["little", "big", "network", "native"])
+def test_uint_values(fmt, byte_order):
+    # unsigned int value formats use a specialized (un)packer, check it against struct.
+    ht = HashTableNT(key_size=key_size, value_type=value_type, value_format=value_format_t(*fmt), byte_order=byte_order)
+    max_values = [2**(8 * struct.calcsize(f)) - 1 for f in fmt]
+    value = value_type(0, 0x0102 & max_values[1], max_values[2])
+    ht[key1] = value
+    assert ht[key1] == value
+    assert type(ht[key1]) == value_type
+    struct_fmt = {"little": "<", "big": ">", "network": "!", "native": "="}[byte_order] + fmt
+    assert ht._get_raw(key1) == struct.pack(struct_fmt, *value)
+    ht._set_raw(key3, struct.pack(struct_fmt, *max_values))
+    assert ht[key3] == value_type(*max_values)
+    for invalid_value in [(-1, 0, 0), (max_values[0] + 1, 0, 0), (0, 0, max_values[2] + 1), (1.5, 0, 0), ("1", 0, 0)]:
+        with pytest.raises(struct.error):
+            ht[key2] = invalid_value
+    assert key2 not in ht
+
+
+def test_narrow_values():
+    # narrower value formats need less memory and disk space.
+    ht = HashTableNT(key_size=key_size, value_type=value_type, value_format=value_format_t("H", "B", "H"))
+    ht.update((H2(i), value_type(i, i % 256, 2**16 - 1)) for i in range(1000))
+    assert len(ht._get_raw(H2(0))) == 5
+    assert ht[H2(999)] == value_type(999, 999 % 256, 2**16 - 1)
+    with pytest.raises(struct.error):
+        ht[key1] = value_type(2**16, 0, 0)
+    assert key1 not in ht
+    with BytesIO() as f:
+        ht.write(f)
+        assert 1000 * (key_size + 5) < f.tell() <= ht.size()
+
+
 def test_update_kvpairs(ntht12):
     ntht12.update([(key3, value3), (key4, value4)])
     assert ntht12[key3] == value3
@@ -107,6 +160,28 @@ def test_update_ntht(ntht12, ntht):
     assert ntht12[key4] == value4
 
 
+@pytest.mark.parametrize("fmt", ["I", "Q"])  # the specialized uint32 packer / struct
+def test_update_batches(fmt):
+    ht = HashTableNT(key_size=key_size, value_type=value_type, value_format=value_format_t(fmt, fmt, fmt))
+    items = {H2(i): value_type(i, 2 * i, 3 * i) for i in range(3000)}  # several batches
+    ht.update(items)
+    assert dict(ht.items()) == items
+    # the items preceding an invalid one are inserted, like with dict.update.
+    with pytest.raises(TypeError):
+        ht.update([(key1, value1), (key2, "invalid"), (key3, value3)])
+    assert ht[key1] == value1
+    assert key2 not in ht and key3 not in ht
+
+
+def test_update_generator_sees_table(ntht):
+    # like dict.update, items from an iterator are inserted before the next one is consumed.
+    ntht[key1] = value_type(0, 0, 0)
+    ntht.update((key1, value_type(ntht[key1].v1 + 1, 0, 0)) for _ in range(3))
+    assert ntht[key1] == value_type(3, 0, 0)
+    ntht.update((key, value_type(len(ntht), 0, 0)) for key in [key2, key3])
+    assert ntht[key3] == value_type(2, 0, 0)
+
+
 def test_ntht_stress(ntht):
     # This also triggers some hashtable resizing.
     keys = set()
@@ -168,6 +243,18 @@ def test_read_write(ntht12, tmp_path):
     assert ntht_loaded[key2] == value2
 
 
+def test_read_write_many(ntht):
+    # more items than processed at once by .write() / .read().
+    ntht.update((H2(i), value_type(i, i, i)) for i in range(10000))
+    with BytesIO() as f:
+        ntht.write(f)
+        data = f.getvalue()
+    ntht_loaded = HashTableNT.read(BytesIO(data))
+    assert dict(ntht_loaded.items()) == dict(ntht.items())
+    with pytest.raises(ValueError):
+        HashTableNT.read(BytesIO(data[:-1]))
+
+
 @pytest.mark.parametrize("n", [1000, 10000, 100000, 1000000])
 def test_size(ntht, n):
     # Fill the hashtable.
@@ -190,3 +277,8 @@ def test_size(ntht, n):
 def test_demo():
     from borghash.__main__ import demo
     demo()
+
+
+def test_pgo_workload():
+    from borghash.__main__ import pgo_workload
+    pgo_workload(count=10000)